@@ -2,53 +2,131 @@ import re
 import json
 import sys
 import os
+import hashlib
+import tempfile
 import threading
 import time
+import asyncio
+from bisect import bisect_right
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog, scrolledtext
 
+# Resolved once; the .env file and the database live next to the script
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB = os.path.join(SCRIPT_DIR, "lab_inventory.json")
+
 # Try to import required libraries
 try:
     from dotenv import load_dotenv
     # Load .env from the same directory as the script
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    load_dotenv(os.path.join(script_dir, ".env"))
+    load_dotenv(os.path.join(SCRIPT_DIR, ".env"))
     DOTENV_AVAILABLE = True
 except ImportError:
     DOTENV_AVAILABLE = False
     print("⚠️ 'python-dotenv' not found. Please install it: pip install python-dotenv")
 
 try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+    print("⚠️ 'aiohttp' library not found. AI features will be disabled. (pip install aiohttp)")
+
+# Optional: stream large inventories instead of parsing them in one go
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+    JSON_DECODE_ERRORS = (json.JSONDecodeError, ijson.JSONError)
+except ImportError:
+    IJSON_AVAILABLE = False
+    JSON_DECODE_ERRORS = (json.JSONDecodeError,)
+
+# Optional: faster (de)serialization; orjson.JSONDecodeError subclasses json.JSONDecodeError
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
 except ImportError:
-    GEMINI_AVAILABLE = False
-    print("⚠️ 'google-generativeai' library not found. AI features will be disabled. (pip install google-generativeai)")
+    ORJSON_AVAILABLE = False
+
+GEMINI_MODEL = "gemini-1.5-flash"
+GEMINI_ENDPOINT = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent"
+# Selections are only cached because generation runs at temperature 0 (deterministic)
+GENERATION_CONFIG = {"responseMimeType": "application/json", "temperature": 0}
+# Abstract requirements per Gemini request, and how many connections may be open at once
+AI_BATCH_SIZE = 8
+AI_MAX_CONNECTIONS = 16
+AI_TIMEOUT_SECONDS = 60
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".lab_architect", "cache")
+# Oldest selections are dropped beyond this so the cache file stays small
+CACHE_MAX_ENTRIES = 5000
+
+# Enforced System Instruction for strict inventory use
+SYSTEM_PROMPT = (
+    "You are an expert Lab Automation Architect. "
+    "Your sole function is to select the single best tool from the provided CANDIDATES list. "
+    "DO NOT suggest, return, or mention any component not explicitly in the list. "
+    "Output only valid JSON."
+)
+# Request body fragment reused by every call
+_SYSTEM_INSTRUCTION = {"parts": [{"text": SYSTEM_PROMPT}]}
+
+# Constant parts of the user prompts; only the requirement, intent and candidates vary
+_PROMPT_HEADER = (
+    "I need to satisfy a dependency requirement using ONLY the tools listed in the 'AVAILABLE CANDIDATES' inventory below.\n\n"
+    "REQUIREMENT: "
+)
+_PROMPT_FOOTER = (
+    "\n\nINSTRUCTIONS:\n"
+    "1. Compare candidate specs against the User Design Intent.\n"
+    "2. Select the single best fit from the list above.\n"
+    "3. Return ONLY a JSON object with this structure. The 'selected_component_name' MUST exactly match a name from the list:\n"
+    '{ "selected_component_name": "Exact Name From List", "reasoning": "Short explanation justifying the choice based on intent." }\n'
+)
+_BATCH_PROMPT_HEADER = (
+    "I need to satisfy several dependency requirements. "
+    "For each TASK, use ONLY the tools listed in that task's 'AVAILABLE CANDIDATES' inventory.\n\n"
+    "USER DESIGN INTENT (Context): \""
+)
+_BATCH_PROMPT_FOOTER = (
+    "\n\nINSTRUCTIONS:\n"
+    "1. For every task, compare candidate specs against the User Design Intent.\n"
+    "2. Select the single best fit from that task's own list.\n"
+    "3. Return ONLY a JSON object with this structure, with one entry per task. "
+    "Each 'selected_component_name' MUST exactly match a name from that task's list:\n"
+    '{ "selections": [ { "task_id": 0, "selected_component_name": "Exact Name From List", '
+    '"reasoning": "Short explanation justifying the choice based on intent." } ] }\n'
+)
+
+# Dependency declarations recognised in documentation text
+_DEP_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE) for pattern in (
+        r"Requires:\s*\[(.*?)\]",
+        r"Dependencies:\s*(.*?)(?:\.|$)",
+        r"Must be connected to:\s*(.*?)(?:\.|$)"
+    )
+]
 
 class LabComponent:
+    # Large inventories hold thousands of these; slots drop the per-instance __dict__
+    __slots__ = ("name", "category", "attributes", "doc_text", "direct_dependencies", "_prompt_str")
+
     def __init__(self, name, category, attributes, documentation_text):
         self.name = name
-        self.category = category
+        # Many components share a category, so keep a single copy of each string
+        self.category = sys.intern(category or "")
         self.attributes = attributes
         self.doc_text = documentation_text
-        self.direct_dependencies = [] 
+        self.direct_dependencies = ()
+        self._prompt_str = None
         self._parse_dependencies()
 
     def _parse_dependencies(self):
-        patterns = [
-            r"Requires:\s*\[(.*?)\]",
-            r"Dependencies:\s*(.*?)(?:\.|$)",
-            r"Must be connected to:\s*(.*?)(?:\.|$)"
-        ]
         found_deps = set()
-        for pattern in patterns:
-            matches = re.findall(pattern, self.doc_text, re.IGNORECASE)
-            for match in matches:
-                items = [item.strip() for item in match.split(',')]
-                for item in items:
-                    if item:
-                        found_deps.add(item)
-        self.direct_dependencies = list(found_deps)
+        for pattern in _DEP_PATTERNS:
+            for match in pattern.findall(self.doc_text):
+                found_deps.update(item.strip() for item in match.split(',') if item.strip())
+        # Read-only and iterated only; interning shares the string across every component naming it
+        self.direct_dependencies = tuple(sys.intern(dep) for dep in found_deps)
 
     def to_dict(self):
         """Serialize to dictionary for JSON saving."""
@@ -70,79 +148,201 @@ class LabComponent:
         )
 
     def to_prompt_string(self):
-        return f"- Name: {self.name}\n  Specs: {json.dumps(self.attributes)}\n  Docs: {self.doc_text.strip()}"
+        # Built once; re-ingesting a tool creates a new component rather than mutating this one
+        if self._prompt_str is None:
+            specs = orjson.dumps(self.attributes).decode() if ORJSON_AVAILABLE else json.dumps(self.attributes)
+            self._prompt_str = f"- Name: {self.name}\n  Specs: {specs}\n  Docs: {self.doc_text.strip()}"
+        return self._prompt_str
+
+class LLMCache:
+    """
+    Two-tier cache for AI selections: an in-process dict backed by a JSON file
+    under ~/.lab_architect/cache/ so decisions survive between sessions.
+    set() only updates memory; flush() writes the file once per build.
+    """
+    def __init__(self, filename=os.path.join(CACHE_DIR, "selections.json")):
+        self.filename = filename
+        self.stats = {"hits": 0, "misses": 0}
+        self._store = {}
+        self._dirty = False
+        self._load()
+
+    @staticmethod
+    def make_key(system_prompt, requirement, candidates, user_intent):
+        payload = {
+            "m": GEMINI_MODEL,
+            "sys": system_prompt,
+            "req": requirement,
+            "intent": user_intent,
+            "cands": sorted(c.name for c in candidates)
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key):
+        value = self._store.get(key)
+        if not self._valid_entry(value):
+            value = None
+        if value is None:
+            self.stats["misses"] += 1
+        else:
+            self.stats["hits"] += 1
+        return value
+
+    def set(self, key, value):
+        # Re-insert so the dict order doubles as least-recently-written order
+        self._store.pop(key, None)
+        self._store[key] = value
+        while len(self._store) > CACHE_MAX_ENTRIES:
+            del self._store[next(iter(self._store))]
+        self._dirty = True
+
+    def flush(self):
+        if self._dirty:
+            self._save()
+
+    def hit_rate(self):
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+    def _load(self):
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                # Drop anything that isn't a well-formed selection (hand edits, older formats)
+                self._store = {key: value for key, value in data.items() if self._valid_entry(value)}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"⚠️ Cache load error: {e}. Starting with an empty cache.")
+
+    @staticmethod
+    def _valid_entry(value):
+        return isinstance(value, dict) and isinstance(value.get("selected_component_name"), str)
+
+    def _save(self):
+        # Write a temp file and swap it in, so a crash or a second instance never leaves a truncated cache
+        tmp_path = None
+        try:
+            cache_dir = os.path.dirname(self.filename)
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._store, f)
+            os.replace(tmp_path, self.filename)
+            self._dirty = False
+        except Exception as e:
+            print(f"⚠️ Cache save error: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
 class AISelector:
+    """
+    Talks to the Gemini REST API through one long-lived aiohttp session, so every
+    request reuses pooled keep-alive connections instead of a fresh TLS handshake.
+    The session lives on a private event loop thread; callers stay synchronous.
+    """
     def __init__(self):
-        self.model = None
         self.api_key = None
-        if GEMINI_AVAILABLE:
+        self.cache = LLMCache()
+        # Decisions made during this app session, keyed without hashing the whole prompt
+        self._session_cache = {}
+        self.session_hits = 0
+        self._loop = None
+        self._session = None
+        self._loop_lock = threading.Lock()
+        if AIOHTTP_AVAILABLE:
             self._configure_gemini()
 
     def _configure_gemini(self):
         # API Key is now loaded via load_dotenv() into os.environ
         self.api_key = os.environ.get("GEMINI_API_KEY")
-        if self.api_key:
-            genai.configure(api_key=self.api_key)
-            # Folosim modelul Flash pentru viteză
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
 
     def set_api_key(self, key):
         self.api_key = key
-        if GEMINI_AVAILABLE and key:
-            genai.configure(api_key=key)
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
+
+    @property
+    def enabled(self):
+        return AIOHTTP_AVAILABLE and bool(self.api_key)
+
+    def clear_session_cache(self):
+        """Forget session decisions; they hold component objects that a registry change replaces."""
+        self._session_cache.clear()
+
+    def close(self):
+        """Write pending cache entries, close the HTTP session and stop the event loop thread."""
+        self.cache.flush()
+        if self._loop is None: return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+            self._session = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+
+    def _run(self, coro):
+        """Run a coroutine on the shared event loop and block until it finishes."""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _call(self, user_prompt):
+        # Only ever runs on the loop thread, so lazy session creation can't race
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=AI_MAX_CONNECTIONS, keepalive_timeout=30),
+                timeout=aiohttp.ClientTimeout(total=AI_TIMEOUT_SECONDS)
+            )
+
+        body = {
+            "systemInstruction": _SYSTEM_INSTRUCTION,
+            "contents": [{"role": "user", "parts": [{"text": user_prompt}]}],
+            "generationConfig": GENERATION_CONFIG
+        }
+        async with self._session.post(GEMINI_ENDPOINT, json=body, headers={"x-goog-api-key": self.api_key}) as resp:
+            if resp.status != 200:
+                raise RuntimeError(f"Gemini HTTP {resp.status}: {await resp.text()}")
+            data = await resp.json()
+        return data["candidates"][0]["content"]["parts"][0]["text"]
+
+    async def _call_many(self, user_prompts):
+        return await asyncio.gather(*(self._call(p) for p in user_prompts), return_exceptions=True)
 
     def choose_best_component(self, requirement, candidates, user_intent):
         if not candidates: return None
         if len(candidates) == 1: return candidates[0]
-        
-        if not self.model:
+
+        # Identical (requirement, candidates, intent) questions always get the same answer
+        cached, cache_keys = self._cached_choice(requirement, candidates, user_intent)
+        if cached:
+            return cached
+
+        if not self.enabled:
             # Fallback if no API key
             return candidates[0]
 
         candidate_text = "\n".join([c.to_prompt_string() for c in candidates])
-        
-        # Enforced System Instruction for strict inventory use
-        system_prompt = (
-            "You are an expert Lab Automation Architect. "
-            "Your sole function is to select the single best tool from the provided CANDIDATES list. "
-            "DO NOT suggest, return, or mention any component not explicitly in the list. "
-            "Output only valid JSON."
-        )
+        by_name = {c.name.lower(): c for c in candidates}
 
-        user_prompt = f"""
-        I need to satisfy a dependency requirement using ONLY the tools listed in the 'AVAILABLE CANDIDATES' inventory below.
-
-        REQUIREMENT: {requirement}
-        USER DESIGN INTENT (Context): "{user_intent}"
-
-        AVAILABLE CANDIDATES (Inventory):
-        {candidate_text}
-
-        INSTRUCTIONS:
-        1. Compare candidate specs against the User Design Intent.
-        2. Select the single best fit from the list above.
-        3. Return ONLY a JSON object with this structure. The 'selected_component_name' MUST exactly match a name from the list:
-        {{ "selected_component_name": "Exact Name From List", "reasoning": "Short explanation justifying the choice based on intent." }}
-        """
+        user_prompt = "".join([
+            _PROMPT_HEADER, requirement,
+            '\nUSER DESIGN INTENT (Context): "', user_intent, '"\n\n',
+            "AVAILABLE CANDIDATES (Inventory):\n", candidate_text,
+            _PROMPT_FOOTER
+        ])
 
         try:
             # Use Gemini's JSON response format feature
-            response = self.model.generate_content(
-                user_prompt,
-                system_instruction=system_prompt,
-                generation_config={"response_mime_type": "application/json"}
-            )
-            
-            content = response.text
+            content = self._run(self._call(user_prompt))
             result_json = json.loads(content)
             selected_name = result_json.get("selected_component_name")
             
             # Match the AI's string selection back to a real object
-            for comp in candidates:
-                if comp.name.lower() == selected_name.lower():
-                    return comp
+            selected = by_name.get((selected_name or "").lower())
+            if selected is not None:
+                self._remember(cache_keys, selected)
+                return selected
             
             # Fallback if AI hallucinated a name not in the list
             print(f"⚠️ AI selected unknown name '{selected_name}'. Defaulting to first option.")
@@ -152,29 +352,193 @@ class AISelector:
             print(f"❌ AI Error: {e}. Defaulting to first option.")
             return candidates[0]
 
+    def choose_best_components_batch(self, tasks, user_intent):
+        """
+        Resolve many (requirement, candidates) tasks in one round trip: uncached tasks are
+        split into chunks of AI_BATCH_SIZE and the chunk requests are sent concurrently.
+        Returns the chosen components in the same order as tasks.
+        """
+        results = [None] * len(tasks)
+        pending = []
+        for task_id, (requirement, candidates) in enumerate(tasks):
+            if len(candidates) <= 1:
+                results[task_id] = candidates[0] if candidates else None
+                continue
+            cached, cache_keys = self._cached_choice(requirement, candidates, user_intent)
+            if cached:
+                results[task_id] = cached
+            else:
+                pending.append((task_id, cache_keys))
+
+        if pending and self.enabled:
+            # Independent chunks are sent concurrently so long batches don't serialize on one response
+            chunks = [pending[i:i + AI_BATCH_SIZE] for i in range(0, len(pending), AI_BATCH_SIZE)]
+            prompts = [self._batch_prompt(tasks, chunk, user_intent) for chunk in chunks]
+            responses = self._run(self._call_many(prompts))
+
+            for chunk, content in zip(chunks, responses):
+                try:
+                    if isinstance(content, Exception): raise content
+                    selections = json.loads(content).get("selections", [])
+                except Exception as e:
+                    print(f"❌ AI Error: {e}. Defaulting to first option.")
+                    continue
+
+                keys_by_task = dict(chunk)
+                for selection in selections:
+                    task_id = selection.get("task_id")
+                    if task_id not in keys_by_task: continue
+                    selected_name = selection.get("selected_component_name") or ""
+                    by_name = {c.name.lower(): c for c in tasks[task_id][1]}
+                    selected = by_name.get(selected_name.lower())
+                    if selected is not None:
+                        results[task_id] = selected
+                        self._remember(keys_by_task[task_id], selected)
+                    else:
+                        print(f"⚠️ AI selected unknown name '{selected_name}' for task {task_id}. Defaulting to first option.")
+
+        # Fallback for anything the AI did not answer (or no API key)
+        for task_id, (_, candidates) in enumerate(tasks):
+            if results[task_id] is None and candidates:
+                results[task_id] = candidates[0]
+        self.cache.flush()
+        return results
+
+    def _batch_prompt(self, tasks, chunk, user_intent):
+        """Build one batch prompt for the (task_id, cache_keys) pairs in chunk."""
+        task_blocks = []
+        for task_id, _ in chunk:
+            requirement, candidates = tasks[task_id]
+            task_blocks.append("".join([
+                "TASK ", str(task_id), "\nREQUIREMENT: ", requirement,
+                "\nAVAILABLE CANDIDATES (Inventory):\n",
+                "\n".join([c.to_prompt_string() for c in candidates])
+            ]))
+
+        return "".join([
+            _BATCH_PROMPT_HEADER, user_intent, '"\n\n',
+            "\n\n".join(task_blocks),
+            _BATCH_PROMPT_FOOTER
+        ])
+
+    def _cached_choice(self, requirement, candidates, user_intent):
+        """
+        Look up an earlier decision, first in the session cache and then in the persistent one.
+        Returns (component, None) on a hit, or (None, cache_keys) to pass to _remember.
+        """
+        by_name = {c.name.lower(): c for c in candidates}
+        session_key = (
+            requirement.lower(),
+            tuple(sorted(by_name)),
+            hashlib.md5(user_intent.encode()).hexdigest()
+        )
+        comp = self._session_cache.get(session_key)
+        if comp is not None:
+            # A decision stored after a registry change may hold a replaced component
+            if by_name.get(comp.name.lower()) is comp:
+                self.session_hits += 1
+                return comp, None
+            self._session_cache.pop(session_key, None)
+
+        cache_key = LLMCache.make_key(SYSTEM_PROMPT, requirement, candidates, user_intent)
+        cached = self.cache.get(cache_key)
+        if cached:
+            comp = by_name.get(cached["selected_component_name"].lower())
+            if comp is not None:
+                self._session_cache[session_key] = comp
+                return comp, None
+        return None, (session_key, cache_key)
+
+    def _remember(self, cache_keys, comp):
+        session_key, cache_key = cache_keys
+        self._session_cache[session_key] = comp
+        self.cache.set(cache_key, {"selected_component_name": comp.name})
+
 class DependencyGraph:
     def __init__(self):
         self.registry = {}
+        self._by_category = {}
+        self._cand_cache = {}
+        # Bumped on every registry change so in-flight lookups can tell their result is stale
+        self._cache_gen = 0
+        self._keys_list = []
+        self._keys_blob = None
+        self._key_offsets = []
         self.ai_agent = AISelector()
 
+    def _register(self, comp):
+        """Add a component to the name registry and the category index."""
+        self._index(comp)
+        self._invalidate_caches()
+
+    def _index(self, comp):
+        key = sys.intern(comp.name.lower())
+        previous = self.registry.get(key)
+        if previous is not None:
+            self._by_category[previous.category.lower()].remove(previous)
+        self.registry[key] = comp
+        self._by_category.setdefault(comp.category.lower(), []).append(comp)
+
+    def _invalidate_caches(self):
+        """Drop everything derived from the registry after it changes."""
+        self._cache_gen += 1
+        self._cand_cache.clear()
+        self._keys_blob = None
+        self.ai_agent.clear_session_cache()
+
     def ingest_documentation(self, name, category, attributes, doc_text):
         component = LabComponent(name, category, attributes, doc_text)
-        self.registry[name.lower()] = component
+        self._register(component)
         return component
 
     def get_candidates(self, requirement):
+        # Memoized per requirement string; cleared whenever the registry changes
+        cached = self._cand_cache.get(requirement)
+        if cached is not None:
+            return cached
+        cache_gen = self._cache_gen
+
         req_lower = requirement.lower()
+        # Tuples: callers share the memoized result and must not see later index mutations
         # 1. Check for exact match
         if req_lower in self.registry:
-            return [self.registry[req_lower]]
-        
-        # 2. Check for category match
-        candidates = []
-        for comp in self.registry.values():
-            if comp.category.lower() == req_lower:
-                candidates.append(comp)
+            candidates = (self.registry[req_lower],)
+        else:
+            # 2. Check for category match
+            candidates = tuple(self._by_category.get(req_lower, ()))
+
+        # Builds run on a worker thread; don't memoize a result computed from a registry that has since changed
+        if cache_gen == self._cache_gen:
+            self._cand_cache[requirement] = candidates
         return candidates
 
+    def _substring_matches(self, needle):
+        """
+        Components whose registry key contains needle. All keys are packed into one
+        NUL-separated string so the scan runs in str.find instead of a Python loop.
+        """
+        if self._keys_blob is None:
+            self._keys_list = list(self.registry)
+            self._keys_blob = "\0".join(self._keys_list)
+            self._key_offsets = []
+            offset = 0
+            for key in self._keys_list:
+                self._key_offsets.append(offset)
+                offset += len(key) + 1
+
+        if not needle or "\0" in needle:
+            return [self.registry[key] for key in self._keys_list if needle in key]
+
+        matches = []
+        pos = self._keys_blob.find(needle)
+        while pos != -1:
+            idx = bisect_right(self._key_offsets, pos) - 1
+            matches.append(self.registry[self._keys_list[idx]])
+            # Continue from the start of the next key so each key matches at most once
+            if idx + 1 == len(self._keys_list): break
+            pos = self._keys_blob.find(needle, self._key_offsets[idx + 1])
+        return matches
+
     def build_lab_config(self, root_request, user_intent):
         if not self.registry:
             return None, [], "Database is empty! Please load lab_inventory.json."
@@ -195,9 +559,7 @@ class DependencyGraph:
             root_candidates.append(self.registry[normalized_request])
         else:
             # 2. Substring match for flexibility
-            for key, comp in self.registry.items():
-                if normalized_request in key: 
-                    root_candidates.append(comp)
+            root_candidates = self._substring_matches(normalized_request)
         
         if not root_candidates:
             # Fallback if the normalized key couldn't find anything
@@ -206,50 +568,96 @@ class DependencyGraph:
         # AI Selects the root node
         root_node = self.ai_agent.choose_best_component(root_request, root_candidates, user_intent)
         
+        # Pass 1: expand every option reachable from the root without asking the AI,
+        # so all decisions go to Gemini together as concurrent batched requests
+        # Components are unique per name in the registry, so id() identifies them
+        # without re-hashing the name strings on every step
+        candidates_map = {}
+        stack = [root_node]
+        expanded = set()
+
+        while stack:
+            current_comp = stack.pop()
+            comp_id = id(current_comp)
+            if comp_id in expanded: continue
+            expanded.add(comp_id)
+
+            for dep_req in current_comp.direct_dependencies:
+                if dep_req in candidates_map: continue
+                # Find candidates in inventory for this requirement
+                candidates = self.get_candidates(dep_req)
+                candidates_map[dep_req] = candidates
+                stack.extend(candidates)
+
+        # Single candidates are resolved locally, only real choices go to the AI
+        resolved_map = {dep_req: candidates[0] for dep_req, candidates in candidates_map.items() if len(candidates) == 1}
+        tasks = [(dep_req, candidates) for dep_req, candidates in candidates_map.items() if len(candidates) > 1]
+        if tasks:
+            choices = self.ai_agent.choose_best_components_batch(tasks, user_intent)
+            for (dep_req, _), chosen_comp in zip(tasks, choices):
+                resolved_map[dep_req] = chosen_comp
+
+        # Pass 2: walk the chosen components only and assemble the plan
         build_plan = {} 
         missing_items = []
         stack = [root_node]
         visited = set()
-        resolved_map = {} 
 
         while stack:
             current_comp = stack.pop()
-            if current_comp.name in visited: continue
-            visited.add(current_comp.name)
+            comp_id = id(current_comp)
+            if comp_id in visited: continue
+            visited.add(comp_id)
 
-            if current_comp.name not in build_plan:
-                build_plan[current_comp.name] = []
+            # Each component is visited once, so its entry can be created unconditionally
+            children = build_plan[current_comp.name] = []
 
             for dep_req in current_comp.direct_dependencies:
-                # Check if we already resolved this requirement type for consistency
-                if dep_req in resolved_map:
-                    chosen_comp = resolved_map[dep_req]
-                else:
-                    # Find candidates in inventory for this requirement
-                    candidates = self.get_candidates(dep_req)
-                    
-                    if not candidates:
-                        missing_items.append(dep_req)
-                        continue
-                    
-                    chosen_comp = self.ai_agent.choose_best_component(dep_req, candidates, user_intent)
-                    resolved_map[dep_req] = chosen_comp
+                chosen_comp = resolved_map.get(dep_req)
+                if chosen_comp is None:
+                    missing_items.append(dep_req)
+                    continue
 
-                build_plan[current_comp.name].append(chosen_comp.name)
+                children.append(chosen_comp.name)
                 stack.append(chosen_comp)
 
+        self.ai_agent.cache.flush()
+        stats = self.ai_agent.cache.stats
+        print(f"[DEBUG] AI cache: {self.ai_agent.session_hits} session hits, "
+              f"{stats['hits']} hits / {stats['misses']} misses on disk (hit rate {self.ai_agent.cache.hit_rate():.0%})")
         return build_plan, missing_items, root_node.name
 
     def save_to_json(self, filename="lab_inventory.json"):
         data = [comp.to_dict() for comp in self.registry.values()]
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2)
+            if ORJSON_AVAILABLE:
+                with open(filename, 'wb') as f:
+                    f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+            else:
+                with open(filename, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, indent=2)
             return True
         except Exception as e:
             print(f"Save error: {e}")
             return False
 
+    @staticmethod
+    def _iter_inventory(filename):
+        """Yield inventory items, streaming with ijson when available so the whole list is never in memory."""
+        if IJSON_AVAILABLE:
+            with open(filename, 'rb') as f:
+                yield from ijson.items(f, "item", use_float=True)
+            return
+
+        if ORJSON_AVAILABLE:
+            with open(filename, 'rb') as f:
+                data = orjson.loads(f.read())
+        else:
+            with open(filename, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        if isinstance(data, list):
+            yield from data
+
     def load_from_json(self, filename):
         if not os.path.exists(filename): return False
         try:
@@ -257,19 +665,21 @@ class DependencyGraph:
                 print("⚠️ JSON file is empty.")
                 return False
                 
-            with open(filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            # Build components straight from the (possibly streamed) items
+            components = [LabComponent.from_dict(item) for item in self._iter_inventory(filename)]
 
-            if not isinstance(data, list) or not data:
+            if not components:
                 print("⚠️ JSON file is loaded, but content is not a list or is empty.")
                 return False
                 
             self.registry = {}
-            for item in data:
-                comp = LabComponent.from_dict(item)
-                self.registry[comp.name.lower()] = comp
+            self._by_category = {}
+            # Bulk load: index everything, then invalidate derived caches once
+            for comp in components:
+                self._index(comp)
+            self._invalidate_caches()
             return True
-        except json.JSONDecodeError:
+        except JSON_DECODE_ERRORS:
             print("❌ JSON Decode Error: File content is not valid JSON.")
             return False
         except Exception as e:
@@ -323,6 +733,9 @@ class LabApp(tk.Tk):
         
         # Bind Selection Event to visualize tree
         self.tree.bind("<<TreeviewSelect>>", self.on_tree_select)
+        # Category children are only inserted once the category is expanded
+        self._cat_children = {}
+        self.tree.bind("<<TreeviewOpen>>", self.on_tree_open)
         
         vsb = ttk.Scrollbar(frame_tree, orient="vertical", command=self.tree.yview)
         self.tree.configure(yscrollcommand=vsb.set)
@@ -340,15 +753,12 @@ class LabApp(tk.Tk):
         """
         Automatically loads 'lab_inventory.json' from the script's directory.
         """
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        default_file = os.path.join(script_dir, "lab_inventory.json")
-        
         self.log("--- Initializing ---")
-        if os.path.exists(default_file):
-            self.log(f"📂 Attempting to load database from: {default_file}")
+        if os.path.exists(DEFAULT_DB):
+            self.log(f"📂 Attempting to load database from: {DEFAULT_DB}")
             
             # Use the robust load_from_json method
-            if self.graph.load_from_json(default_file):
+            if self.graph.load_from_json(DEFAULT_DB):
                 self.log(f"✅ Database loaded successfully! {len(self.graph.registry)} items found.")
                 # Print the key we need to search for the default item
                 if "advanced liquid handler system" in self.graph.registry:
@@ -385,13 +795,24 @@ class LabApp(tk.Tk):
             if cat not in categories: categories[cat] = []
             categories[cat].append(comp)
 
+        self._cat_children = {}
         for cat in sorted(categories.keys()):
             cat_node = self.tree.insert("", tk.END, text=cat, open=False)
-            for comp in categories[cat]:
-                deps = ", ".join(comp.direct_dependencies) if comp.direct_dependencies else "None"
-                self.tree.insert(cat_node, tk.END, text=comp.name, values=(comp.category, deps))
+            # Placeholder keeps the expand arrow until the real children are inserted
+            self.tree.insert(cat_node, tk.END, text="", tags=("placeholder",))
+            self._cat_children[cat_node] = categories[cat]
         
-        self.log(f"Tree View Refreshed. Items: {len(self.graph.registry)}")
+        self.log(f"Tree View Refreshed. Items: {len(self.graph.registry)} in {len(categories)} categories")
+
+    def on_tree_open(self, event):
+        node = self.tree.focus()
+        children = self.tree.get_children(node)
+        if not children or "placeholder" not in self.tree.item(children[0], "tags"): return
+
+        self.tree.delete(children[0])
+        for comp in self._cat_children.pop(node, []):
+            deps = ", ".join(comp.direct_dependencies) if comp.direct_dependencies else "None"
+            self.tree.insert(node, tk.END, text=comp.name, values=(comp.category, deps))
 
     # --- Tree Visualization Logic ---
     def on_tree_select(self, event):
@@ -405,29 +826,29 @@ class LabApp(tk.Tk):
             self.display_component_tree(comp)
 
     def display_component_tree(self, root_comp):
-        self.log_area.config(state='normal')
-        self.log_area.delete("1.0", tk.END)
-        
-        self.log_area.insert(tk.END, f"📦 SELECTED: {root_comp.name}\n")
-        self.log_area.insert(tk.END, f"   Category: {root_comp.category}\n")
+        buf = [f"📦 SELECTED: {root_comp.name}\n", f"   Category: {root_comp.category}\n"]
         if root_comp.attributes:
-             self.log_area.insert(tk.END, f"   Specs: {root_comp.attributes}\n")
-        self.log_area.insert(tk.END, "="*50 + "\n\n")
-        self.log_area.insert(tk.END, "🌳 FULL DEPENDENCY HIERARCHY:\n")
+             buf.append(f"   Specs: {root_comp.attributes}\n")
+        buf.append("="*50 + "\n\n")
+        buf.append("🌳 FULL DEPENDENCY HIERARCHY:\n")
         
-        self._print_recursive_tree(root_comp)
+        self._print_recursive_tree(root_comp, buf)
         
+        # One insert per render instead of one per line
+        self.log_area.config(state='normal')
+        self.log_area.delete("1.0", tk.END)
+        self.log_area.insert(tk.END, "".join(buf))
         self.log_area.config(state='disabled')
 
-    def _print_recursive_tree(self, comp, prefix="", is_last=True, visited=None):
+    def _print_recursive_tree(self, comp, buf, prefix="", is_last=True, visited=None):
         if visited is None: visited = set()
         
         if comp.name in visited:
-            self.log_area.insert(tk.END, f"{prefix}{'└── ' if is_last else '├── '}{comp.name} (Cycle Detected 🔄)\n")
+            buf.append(f"{prefix}{'└── ' if is_last else '├── '}{comp.name} (Cycle Detected 🔄)\n")
             return
         
         connector = "└── " if is_last else "├── "
-        self.log_area.insert(tk.END, f"{prefix}{connector}{comp.name}\n")
+        buf.append(f"{prefix}{connector}{comp.name}\n")
         
         visited.add(comp.name)
         
@@ -439,28 +860,25 @@ class LabApp(tk.Tk):
             candidates = self.graph.get_candidates(req)
             
             if not candidates:
-                self.log_area.insert(tk.END, f"{new_prefix}{'└── ' if is_last_child else '├── '}⚠️ {req} (Missing)\n")
+                buf.append(f"{new_prefix}{'└── ' if is_last_child else '├── '}⚠️ {req} (Missing)\n")
             elif len(candidates) == 1:
-                self._print_recursive_tree(candidates[0], new_prefix, is_last_child, visited.copy())
+                self._print_recursive_tree(candidates[0], buf, new_prefix, is_last_child, visited.copy())
             else:
-                self.log_area.insert(tk.END, f"{new_prefix}{'└── ' if is_last_child else '├── '}❓ {req} (Abstract: {len(candidates)} options)\n")
+                buf.append(f"{new_prefix}{'└── ' if is_last_child else '├── '}❓ {req} (Abstract: {len(candidates)} options)\n")
                 option_prefix = new_prefix + ("    " if is_last_child else "│   ")
                 for j, cand in enumerate(candidates):
                     is_last_opt = (j == len(candidates) - 1)
-                    self._print_recursive_tree(cand, option_prefix, is_last_opt, visited.copy())
+                    self._print_recursive_tree(cand, buf, option_prefix, is_last_opt, visited.copy())
 
     def save_db(self):
-        if self.graph.save_to_json("lab_inventory.json"):
+        if self.graph.save_to_json(DEFAULT_DB):
             messagebox.showinfo("Success", "Database saved to 'lab_inventory.json'")
             self.log("💾 Database saved.")
         else:
             messagebox.showerror("Error", "Failed to save database.")
 
     def load_db_dialog(self):
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        default_file = os.path.join(script_dir, "lab_inventory.json")
-        
-        if self.graph.load_from_json(default_file):
+        if self.graph.load_from_json(DEFAULT_DB):
             self.refresh_tree_view()
             messagebox.showinfo("Success", "Database loaded!")
             self.log(f"📂 Database loaded successfully! {len(self.graph.registry)} items found.")
@@ -524,68 +942,71 @@ class LabApp(tk.Tk):
         self.lbl_status = ttk.Label(win, text="Ready", font=('Segoe UI', 10, 'italic'), foreground="gray")
         self.lbl_status.pack(pady=5)
 
+        # Animated natively by Tk, so no Python callbacks run while Gemini is working
+        pb = ttk.Progressbar(win, mode='indeterminate', length=160)
+        pb.pack()
+
         result_area = scrolledtext.ScrolledText(win, height=20)
         result_area.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
-        self.is_building = False
-        
-        def animate_loading():
-            chars = ["⠋", "⠙", "⠹", "⠸", "⠼", "⠴", "⠦", "⠧", "⠇", "⠏"]
-            idx = 0
-            def step():
-                if not self.is_building or not win.winfo_exists(): return
-                nonlocal idx
-                self.lbl_status.config(text=f"Gemini is thinking {chars[idx]}", foreground="blue")
-                idx = (idx + 1) % len(chars)
-                win.after(100, step)
-            step()
-
         def run_build():
             target = entry_target.get().strip()
             intent = text_intent.get("1.0", tk.END).strip()
             if not target: return
 
-            self.is_building = True
             result_area.delete("1.0", tk.END)
-            animate_loading()
+            self.lbl_status.config(text="Gemini is thinking...", foreground="blue")
+            pb.start(80)
             
             btn_generate.config(state='disabled')
 
+            def format_report(plan, missing, root_name):
+                output_lines = []
+                if not plan:
+                    output_lines.append(f"❌ Failed: {root_name}\n")
+                    return "".join(output_lines)
+
+                output_lines.append(f"✅ Build Plan for: {root_name}\n")
+                output_lines.append("="*40 + "\n")
+                
+                def print_recursive(node, prefix="", is_last=True, visited=None):
+                    if visited is None: visited = set()
+                    connector = "└── " if is_last else "├── "
+                    # A plan can point back at an ancestor (components requiring each other)
+                    if node in visited:
+                        output_lines.append(prefix + connector + node + " (Cycle Detected 🔄)\n")
+                        return
+                    output_lines.append(prefix + connector + node + "\n")
+                    visited.add(node)
+                    prefix += "    " if is_last else "│   "
+                    children = plan.get(node, [])
+                    count = len(children)
+                    for i, child in enumerate(children):
+                        print_recursive(child, prefix, i == count - 1, visited.copy())
+
+                print_recursive(root_name)
+                
+                if missing:
+                    output_lines.append("\n⚠️ Missing Components:\n")
+                    for m in missing:
+                        output_lines.append(f" - {m}\n")
+                return "".join(output_lines)
+
             def task():
+                # Format the report here, off the Tk thread; the UI only inserts the finished text.
+                # Any failure still produces text, so update_ui always runs and resets the window.
                 try:
                     plan, missing, root_name = self.graph.build_lab_config(target, intent)
+                    text = format_report(plan, missing, root_name)
                 except Exception as e:
-                    plan, missing, root_name = None, [], str(e)
+                    text = format_report(None, [], str(e))
 
-                self.is_building = False
-                
                 def update_ui():
                     if not win.winfo_exists(): return
+                    pb.stop()
                     self.lbl_status.config(text="Done.", foreground="green")
                     btn_generate.config(state='normal')
-                    
-                    if not plan:
-                        result_area.insert(tk.END, f"❌ Failed: {root_name}\n")
-                    else:
-                        result_area.insert(tk.END, f"✅ Build Plan for: {root_name}\n")
-                        result_area.insert(tk.END, "="*40 + "\n")
-                        
-                        def print_recursive(node, prefix="", is_last=True):
-                            connector = "└── " if is_last else "├── "
-                            line = prefix + connector + node + "\n"
-                            result_area.insert(tk.END, line)
-                            prefix += "    " if is_last else "│   "
-                            children = plan.get(node, [])
-                            count = len(children)
-                            for i, child in enumerate(children):
-                                print_recursive(child, prefix, i == count - 1)
-
-                        print_recursive(root_name)
-                        
-                        if missing:
-                            result_area.insert(tk.END, "\n⚠️ Missing Components:\n")
-                            for m in missing:
-                                result_area.insert(tk.END, f" - {m}\n")
+                    result_area.insert(tk.END, text)
 
                 win.after(0, update_ui)
 
@@ -597,6 +1018,7 @@ class LabApp(tk.Tk):
 def main():
     app = LabApp()
     app.mainloop()
+    app.graph.ai_agent.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file